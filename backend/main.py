@@ -1,6 +1,7 @@
 """
 main.py - FastAPI entry point for SecInt v2 Threat Intelligence API
 """
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
@@ -13,15 +14,27 @@ load_dotenv()
 from routers import iocs
 from routers import reports
 from routers import ingestion
-from database import connect_db, disconnect_db
+from database import connect_db, disconnect_db, get_db_client
 from services.api_validator import api_validator
+from services.report_generator import create_report_generator
+from services.threat_feeds import threat_feeds
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: connect to MongoDB
+    # Startup: connect to MongoDB and make sure report indexes exist
     await connect_db()
+    generator = create_report_generator(get_db_client())
+    await generator.ensure_indexes()
+    # Keep the materialized executive summary fresh in the background
+    summary_task = asyncio.create_task(generator.run_summary_refresher())
     yield
-    # Shutdown: disconnect
+    # Shutdown: stop background refresh, close HTTP pool and disconnect
+    summary_task.cancel()
+    try:
+        await summary_task
+    except asyncio.CancelledError:
+        pass
+    await threat_feeds.aclose()
     await disconnect_db()
 
 app = FastAPI(
@@ -6,7 +6,9 @@ from pydantic import BaseModel
 from typing import Optional
 import logging
 
+from database import get_db_client
 from services.direct_ingest import DirectThreatIngestionService
+from services.report_generator import create_report_generator, invalidate_report_cache
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +27,14 @@ class IngestionResult(BaseModel):
     message: str
     stats: Optional[dict] = None
 
+async def refresh_report_views():
+    """Rebuild the materialized summary, then drop cached reports so they see new IOCs"""
+    try:
+        await create_report_generator(get_db_client()).refresh_summary()
+    except Exception as e:
+        logger.error(f"Failed to refresh executive summary after ingestion: {e}")
+    invalidate_report_cache()
+
 async def run_ingestion_background():
     """Run ingestion in background"""
     global ingestion_status
@@ -49,6 +59,7 @@ async def run_ingestion_background():
         ingestion_status["progress"] = "Fetching URLhaus payloads..."
         await service.ingest_urlhaus_payloads(limit=50)  # Reduced from 100 to 50
         
+        await refresh_report_views()
         await disconnect_db()
         
         ingestion_status["last_result"] = {
@@ -60,6 +71,8 @@ async def run_ingestion_background():
         
     except Exception as e:
         logger.error(f"Background ingestion failed: {e}")
+        # A failed run may already have inserted batches
+        await refresh_report_views()
         ingestion_status["last_result"] = {
             "status": "error",
             "error": str(e)
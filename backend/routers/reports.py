@@ -3,10 +3,9 @@ reports.py - Report generation API endpoints
 Provides endpoints for generating and downloading threat intelligence reports
 """
 from fastapi import APIRouter, Query, HTTPException, Response
-from fastapi.responses import StreamingResponse, HTMLResponse
+from fastapi.responses import StreamingResponse, HTMLResponse, ORJSONResponse
 from typing import Optional, List
 from datetime import datetime
-import io
 import logging
 
 from database import get_db_client
@@ -138,15 +137,20 @@ async def download_csv_report(
         if severity:
             severity_filter = [s.value for s in severity]
         
-        csv_content = await generator.generate_csv_report(severity_filter, limit)
+        filename = f"secint_threats_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.csv"
         
-        # Create streaming response
-        output = io.BytesIO(csv_content.encode('utf-8'))
+        # Pull the first chunk (which runs the query) here, so database errors
+        # still become a 500 instead of a truncated 200 response
+        chunks = generator.stream_csv_report(severity_filter, limit)
+        first_chunk = await anext(chunks)
         
-        filename = f"secint_threats_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.csv"
+        async def body():
+            yield first_chunk
+            async for chunk in chunks:
+                yield chunk
         
         return StreamingResponse(
-            output,
+            body(),
             media_type="text/csv",
             headers={
                 "Content-Disposition": f"attachment; filename={filename}"
@@ -157,7 +161,7 @@ async def download_csv_report(
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.get("/download/json")
+@router.get("/download/json", response_class=ORJSONResponse)
 async def download_json_report(include_summary: bool = Query(True)):
     """
     Download threat intelligence report in JSON format
@@ -176,9 +180,8 @@ async def download_json_report(include_summary: bool = Query(True)):
         
         filename = f"secint_report_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.json"
         
-        return Response(
-            content=str(report_data).encode('utf-8'),
-            media_type="application/json",
+        return ORJSONResponse(
+            content=report_data,
             headers={
                 "Content-Disposition": f"attachment; filename={filename}"
             }
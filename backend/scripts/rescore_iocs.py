@@ -0,0 +1,16 @@
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo import MongoClient
+from services.severity_scorer import severity_scorer
+
+client = MongoClient('mongodb://localhost:27017')
+col = client['secint']['iocs']
+
+# Recompute severity_score/severity for every IOC inside MongoDB
+result = col.update_many({}, severity_scorer.build_rescore_pipeline())
+
+print(json.dumps({'matched': result.matched_count, 'modified': result.modified_count}, indent=2))
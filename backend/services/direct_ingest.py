@@ -3,12 +3,14 @@ Direct Threat Intelligence Ingestion Service - SecInt v2 (Localhost Version)
 Fetches data from threat feeds and stores directly in MongoDB (no Kafka).
 """
 import asyncio
+import calendar
 import os
 import sys
 import logging
 import uuid
 from datetime import datetime
 from dotenv import load_dotenv
+from pymongo.errors import BulkWriteError
 
 # Add parent directory to path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -35,6 +37,9 @@ class DirectThreatIngestionService:
     No Kafka - runs synchronously for localhost development.
     """
     
+    # Number of scored IOCs buffered before a single insert_many round-trip
+    INSERT_BATCH_SIZE = 200
+    
     def __init__(self):
         self.stats = {
             'otx_pulses': 0,
@@ -44,21 +49,66 @@ class DirectThreatIngestionService:
             'iocs_enriched': 0,
             'failed_stores': 0
         }
+        self._pending = []
+        self._pending_values = set()
+    
+    async def flush_pending(self) -> int:
+        """
+        Write all buffered IOCs to MongoDB in a single insert_many call.
+        
+        Returns:
+            Number of IOCs written
+        """
+        if not self._pending:
+            return 0
+        
+        batch = self._pending
+        self._pending = []
+        self._pending_values = set()
+        
+        try:
+            collection = get_collection("iocs")
+            result = await collection.insert_many(batch, ordered=False)
+            return len(result.inserted_ids)
+        except BulkWriteError as e:
+            failed = len(e.details.get('writeErrors', []))
+            logger.error(f"❌ Failed to store {failed}/{len(batch)} buffered IOCs")
+        except Exception as e:
+            failed = len(batch)
+            logger.error(f"❌ Failed to store {failed} buffered IOCs: {e}")
+        
+        self.stats['iocs_stored'] -= failed
+        self.stats['failed_stores'] += failed
+        return len(batch) - failed
+    
+    async def _flush_if_full(self) -> int:
+        """
+        Flush the insert buffer once it reaches INSERT_BATCH_SIZE.
+        
+        Returns:
+            Number of IOCs written (0 if the buffer was not full)
+        """
+        if len(self._pending) >= self.INSERT_BATCH_SIZE:
+            return await self.flush_pending()
+        return 0
     
     async def store_ioc(self, ioc_data: dict) -> bool:
         """
-        Store IOC directly to MongoDB with enrichment and severity scoring.
+        Enrich and score an IOC, then buffer it for a batched insert.
         
         Args:
             ioc_data: Dictionary containing IOC information
             
         Returns:
-            bool: True if successful, False otherwise
+            bool: True if buffered, False otherwise (call flush_pending to write)
         """
         try:
             collection = get_collection("iocs")
             
-            # Check if IOC already exists
+            # Check if IOC already exists (stored or waiting in the insert buffer)
+            if ioc_data.get("ioc_value") in self._pending_values:
+                logger.debug(f"IOC already buffered: {ioc_data.get('ioc_value')}")
+                return False
             existing = await collection.find_one({"ioc_value": ioc_data.get("ioc_value")})
             if existing:
                 logger.debug(f"IOC already exists: {ioc_data.get('ioc_value')}")
@@ -90,7 +140,9 @@ class DirectThreatIngestionService:
             merged_data = {**ioc_data, **enriched_data}
             
             # Calculate severity score using merged data
-            severity_info = severity_scorer.calculate_severity(merged_data)
+            now = datetime.utcnow()
+            now_ts = calendar.timegm(now.timetuple())
+            severity_info = severity_scorer.calculate_severity(merged_data, now, now_ts)
             
             # Merge and normalize data, add correlation and metadata
             correlation_id = str(uuid.uuid4())
@@ -140,15 +192,17 @@ class DirectThreatIngestionService:
                 "vt_detections": vt_detections,
                 "vt_detection_rate": vt_rate,
                 "threat_actor": threat_actor,
-                "first_seen": datetime.utcnow(),
-                "last_updated": datetime.utcnow(),
+                "first_seen": now,
+                "first_seen_ts": now_ts,
+                "last_updated": now,
                 "enrichment_status": "completed"
             }
 
-            # Store in MongoDB
-            await collection.insert_one(final_ioc)
+            # Buffer for a batched insert into MongoDB
+            self._pending.append(final_ioc)
+            self._pending_values.add(ioc_value)
 
-            logger.debug(f"✅ Stored IOC: {ioc_data.get('ioc_value')} - {severity_info.get('severity')}")
+            logger.debug(f"✅ Buffered IOC: {ioc_data.get('ioc_value')} - {severity_info.get('severity')}")
             self.stats['iocs_stored'] += 1
             self.stats['iocs_enriched'] += 1
 
@@ -176,6 +230,7 @@ class DirectThreatIngestionService:
             self.stats['otx_pulses'] = len(pulses)
             logger.info(f"✅ Fetched {len(pulses)} OTX pulses")
             
+            # Counts IOCs actually written by flush_pending, not just buffered
             ioc_count = 0
             
             for pulse in pulses:
@@ -225,14 +280,18 @@ class DirectThreatIngestionService:
                     
                     # Store IOC
                     if await self.store_ioc(ioc_data):
-                        ioc_count += 1
-                
+                        ioc_count += await self._flush_if_full()
+            
+            ioc_count += await self.flush_pending()
             logger.info(f"✅ Stored {ioc_count} new IOCs from OTX")
             return ioc_count
             
         except Exception as e:
             logger.error(f"❌ Failed to ingest OTX pulses: {e}")
             return 0
+        finally:
+            # Write whatever was already enriched and buffered, even on failure
+            await self.flush_pending()
     
     async def ingest_urlhaus_urls(self, limit: int = 100) -> int:
         """
@@ -251,6 +310,7 @@ class DirectThreatIngestionService:
             self.stats['urlhaus_urls'] = len(urls)
             logger.info(f"✅ Fetched {len(urls)} URLhaus URLs")
             
+            # Counts IOCs actually written by flush_pending, not just buffered
             ioc_count = 0
             
             for url_data in urls:
@@ -276,7 +336,7 @@ class DirectThreatIngestionService:
                 }
                 
                 if await self.store_ioc(url_ioc):
-                    ioc_count += 1
+                    ioc_count += await self._flush_if_full()
                 
                 # Store host as domain IOC
                 if host and "." in host:
@@ -291,14 +351,18 @@ class DirectThreatIngestionService:
                     }
 
                     if await self.store_ioc(domain_ioc):
-                        ioc_count += 1
+                        ioc_count += await self._flush_if_full()
 
+            ioc_count += await self.flush_pending()
             logger.info(f"✅ Stored {ioc_count} new IOCs from URLhaus URLs")
             return ioc_count
 
         except Exception as e:
             logger.error(f"❌ Failed to ingest URLhaus URLs: {e}")
             return 0
+        finally:
+            # Write whatever was already enriched and buffered, even on failure
+            await self.flush_pending()
     
     async def ingest_urlhaus_payloads(self, limit: int = 100) -> int:
         """
@@ -317,6 +381,7 @@ class DirectThreatIngestionService:
             self.stats['urlhaus_payloads'] = len(payloads)
             logger.info(f"✅ Fetched {len(payloads)} URLhaus payloads")
             
+            # Counts IOCs actually written by flush_pending, not just buffered
             ioc_count = 0
             
             for payload in payloads:
@@ -336,7 +401,7 @@ class DirectThreatIngestionService:
                     }
                     
                     if await self.store_ioc(sha256_ioc):
-                        ioc_count += 1
+                        ioc_count += await self._flush_if_full()
                 
                 # Store MD5
                 if md5:
@@ -351,14 +416,18 @@ class DirectThreatIngestionService:
                     }
                     
                     if await self.store_ioc(md5_ioc):
-                        ioc_count += 1
+                        ioc_count += await self._flush_if_full()
             
+            ioc_count += await self.flush_pending()
             logger.info(f"✅ Stored {ioc_count} new IOCs from URLhaus payloads")
             return ioc_count
             
         except Exception as e:
             logger.error(f"❌ Failed to ingest URLhaus payloads: {e}")
             return 0
+        finally:
+            # Write whatever was already enriched and buffered, even on failure
+            await self.flush_pending()
     
     async def run_full_ingestion(self):
         """
@@ -396,6 +465,8 @@ class DirectThreatIngestionService:
             logger.error(f"❌ Ingestion failed: {e}")
             raise
         finally:
+            await self.flush_pending()
+            await threat_feeds.aclose()
             await disconnect_db()
 
 
@@ -408,4 +479,10 @@ async def main():
 
 
 if __name__ == "__main__":
+    # Use uvloop when available (installed with uvicorn[standard], not on Windows)
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
     asyncio.run(main())
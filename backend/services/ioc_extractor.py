@@ -3,6 +3,9 @@ ioc_extractor.py - Rule-based IOC extraction using regex patterns
 Extracts IPs, domains, URLs, file hashes, and CVE numbers from threat data
 """
 import re
+import hashlib
+import ipaddress
+from collections import OrderedDict
 from typing import List, Dict, Set
 from enum import Enum
 
@@ -24,23 +27,43 @@ class IOCExtractor:
         IOCType.IPV4: r'\b(?:(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.){3}(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\b',
         IOCType.DOMAIN: r'\b(?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+[a-z]{2,}\b',
         IOCType.URL: r'https?://[^\s<>"{}|\\^`\[\]]+',
-        IOCType.MD5: r'\b[a-fA-F0-9]{32}\b',
-        IOCType.SHA1: r'\b[a-fA-F0-9]{40}\b',
-        IOCType.SHA256: r'\b[a-fA-F0-9]{64}\b',
-        IOCType.CVE: r'CVE-\d{4}-\d{4,7}',
+        IOCType.CVE: r'[Cc][Vv][Ee]-\d{4}-\d{4,7}',
         IOCType.EMAIL: r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b',
     }
     
-    # Private IP ranges to filter out
-    PRIVATE_IP_PATTERNS = [
-        r'^127\.',           # Loopback
-        r'^10\.',            # Class A private
-        r'^172\.(1[6-9]|2[0-9]|3[0-1])\.',  # Class B private
-        r'^192\.168\.',      # Class C private
-        r'^0\.',             # Invalid
-        r'^169\.254\.',      # Link-local
-        r'^224\.',           # Multicast
-        r'^255\.',           # Broadcast
+    # Only these patterns contain letters that need case folding; the others
+    # are digit-only or already spell out both cases
+    CASE_INSENSITIVE_TYPES = {IOCType.DOMAIN, IOCType.URL, IOCType.EMAIL}
+    
+    # Literal every match of a pattern must contain; texts without it skip
+    # the regex scan entirely
+    REQUIRED_SUBSTRINGS = {
+        IOCType.IPV4: '.',
+        IOCType.DOMAIN: '.',
+        IOCType.URL: '://',
+        IOCType.CVE: '-',
+        IOCType.EMAIL: '@',
+    }
+    
+    # Single pattern for all file hashes; the hash type is decided by length
+    HASH_PATTERN = r'\b[a-fA-F0-9]{32,64}\b'
+    HASH_LENGTHS = {
+        32: IOCType.MD5,
+        40: IOCType.SHA1,
+        64: IOCType.SHA256,
+    }
+    MIN_HASH_LENGTH = min(HASH_LENGTHS)
+    
+    # Private/reserved IP networks to filter out
+    PRIVATE_IP_NETWORKS = [
+        '127.0.0.0/8',       # Loopback
+        '10.0.0.0/8',        # Class A private
+        '172.16.0.0/12',     # Class B private
+        '192.168.0.0/16',    # Class C private
+        '0.0.0.0/8',         # Invalid
+        '169.254.0.0/16',    # Link-local
+        '224.0.0.0/4',       # Multicast
+        '255.0.0.0/8',       # Broadcast
     ]
     
     # Common non-threatening domains to filter
@@ -50,22 +73,42 @@ class IOCExtractor:
         'w3.org', 'ietf.org', 'github.com', 'stackoverflow.com'
     }
     
+    # LRU cache of extraction results keyed on a digest of the input text;
+    # short texts are cheaper to scan than to hash and are not cached
+    CACHE_SIZE = 100_000
+    CACHE_MIN_LENGTH = 256
+    
     def __init__(self):
         """Initialize compiled regex patterns for performance"""
+        # No re.ASCII: ASCII-only \b treats non-ASCII letters as boundaries, so
+        # "müller.de" would yield "ller.de" and homographs like "pаypal.com"
+        # (Cyrillic 'а') would yield "ypal.com"
         self.compiled_patterns = {
-            ioc_type: re.compile(pattern, re.IGNORECASE)
+            ioc_type: re.compile(
+                pattern,
+                re.IGNORECASE if ioc_type in self.CASE_INSENSITIVE_TYPES else 0
+            )
             for ioc_type, pattern in self.PATTERNS.items()
         }
-        self.private_ip_compiled = [
-            re.compile(pattern) for pattern in self.PRIVATE_IP_PATTERNS
+        self.hash_pattern = re.compile(self.HASH_PATTERN)
+        # All benign domains as one alternation so each URL is scanned once
+        self.benign_domain_pattern = re.compile(
+            '|'.join(re.escape(domain) for domain in sorted(self.BENIGN_DOMAINS))
+        )
+        # (network, netmask) pairs as 32-bit integers for bitwise range checks
+        self.private_ip_masks = [
+            (int(net.network_address), int(net.netmask))
+            for net in map(ipaddress.ip_network, self.PRIVATE_IP_NETWORKS)
         ]
+        self._cache = OrderedDict()
     
-    def extract_all(self, text: str) -> Dict[str, List[str]]:
+    def extract_all(self, text: str, sort: bool = False) -> Dict[str, List[str]]:
         """
         Extract all IOC types from text
         
         Args:
             text: Input text to extract IOCs from
+            sort: Return each IOC list in lexical order
             
         Returns:
             Dictionary with IOC types as keys and lists of unique IOCs as values
@@ -73,34 +116,101 @@ class IOCExtractor:
         if not text:
             return {}
         
+        if len(text) < self.CACHE_MIN_LENGTH:
+            results = self._extract_all(text)
+        else:
+            results = self._extract_all_cached(text)
+        
+        if sort:
+            for iocs in results.values():
+                iocs.sort()
+        
+        return results
+    
+    def _extract_all_cached(self, text: str) -> Dict[str, List[str]]:
+        """Return _extract_all results through the text-digest LRU cache"""
+        key = hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+        cached = self._cache.get(key)
+        if cached is None:
+            # Store immutable tuples so callers can't mutate cached results
+            cached = tuple(
+                (ioc_type, tuple(iocs)) for ioc_type, iocs in self._extract_all(text).items()
+            )
+            self._cache[key] = cached
+            if len(self._cache) > self.CACHE_SIZE:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        
+        return {ioc_type: list(iocs) for ioc_type, iocs in cached}
+    
+    def _extract_all(self, text: str) -> Dict[str, List[str]]:
+        """Run every IOC pattern over text (uncached)"""
         results = {}
         
         for ioc_type, pattern in self.compiled_patterns.items():
+            if self.REQUIRED_SUBSTRINGS[ioc_type] not in text:
+                continue
+            
             matches = pattern.findall(text)
             if matches:
                 # Deduplicate and validate
                 unique_iocs = self._validate_iocs(ioc_type, set(matches))
                 if unique_iocs:
-                    results[ioc_type.value] = sorted(list(unique_iocs))
+                    results[ioc_type.value] = list(unique_iocs)
+        
+        for ioc_type, hashes in self._extract_hashes(text).items():
+            results[ioc_type.value] = list(hashes)
         
         return results
     
-    def extract_by_type(self, text: str, ioc_type: IOCType) -> List[str]:
+    def extract_by_type(self, text: str, ioc_type: IOCType, sort: bool = False) -> List[str]:
         """
         Extract specific IOC type from text
         
         Args:
             text: Input text
             ioc_type: Type of IOC to extract
+            sort: Return IOCs in lexical order
             
         Returns:
             List of unique validated IOCs
         """
-        if not text or ioc_type not in self.compiled_patterns:
+        if not text:
             return []
         
-        matches = self.compiled_patterns[ioc_type].findall(text)
-        return sorted(list(self._validate_iocs(ioc_type, set(matches))))
+        if ioc_type in self.HASH_LENGTHS.values():
+            iocs = self._extract_hashes(text).get(ioc_type, set())
+        elif ioc_type in self.compiled_patterns:
+            if self.REQUIRED_SUBSTRINGS[ioc_type] not in text:
+                return []
+            matches = self.compiled_patterns[ioc_type].findall(text)
+            iocs = self._validate_iocs(ioc_type, set(matches))
+        else:
+            return []
+        
+        return sorted(iocs) if sort else list(iocs)
+    
+    def _extract_hashes(self, text: str) -> Dict[IOCType, Set[str]]:
+        """
+        Extract MD5/SHA1/SHA256 hashes in a single scan
+        
+        Args:
+            text: Input text
+            
+        Returns:
+            Dictionary mapping hash IOC types to sets of lowercase hashes
+        """
+        hashes = {}
+        if len(text) < self.MIN_HASH_LENGTH:
+            return hashes
+        
+        for match in self.hash_pattern.findall(text):
+            ioc_type = self.HASH_LENGTHS.get(len(match))
+            if ioc_type:
+                hashes.setdefault(ioc_type, set()).add(match.lower())
+        
+        return hashes
     
     def _validate_iocs(self, ioc_type: IOCType, iocs: Set[str]) -> Set[str]:
         """
@@ -120,8 +230,6 @@ class IOCExtractor:
             return self._validate_ips(iocs)
         elif ioc_type == IOCType.DOMAIN:
             return self._validate_domains(iocs)
-        elif ioc_type in [IOCType.MD5, IOCType.SHA1, IOCType.SHA256]:
-            return self._validate_hashes(iocs)
         elif ioc_type == IOCType.URL:
             return self._validate_urls(iocs)
         else:
@@ -132,19 +240,19 @@ class IOCExtractor:
         valid_ips = set()
         
         for ip in ips:
-            # Check if IP is private
-            is_private = any(
-                pattern.match(ip) for pattern in self.private_ip_compiled
-            )
+            # Pack the dotted quad into a 32-bit integer (octets are parsed as
+            # decimal; socket.inet_aton would read leading zeros as octal)
+            try:
+                a, b, c, d = map(int, ip.split('.'))
+            except ValueError:
+                continue
+            if not (a | b | c | d) <= 255:
+                continue
+            packed = (a << 24) | (b << 16) | (c << 8) | d
             
-            if not is_private:
-                # Validate octets are in range
-                try:
-                    octets = [int(x) for x in ip.split('.')]
-                    if all(0 <= octet <= 255 for octet in octets):
-                        valid_ips.add(ip)
-                except ValueError:
-                    continue
+            # Check if IP falls inside a private/reserved network
+            if not any(packed & mask == network for network, mask in self.private_ip_masks):
+                valid_ips.add(ip)
         
         return valid_ips
     
@@ -171,10 +279,6 @@ class IOCExtractor:
         
         return valid_domains
     
-    def _validate_hashes(self, hashes: Set[str]) -> Set[str]:
-        """Validate hash format (hex characters only)"""
-        return {h.lower() for h in hashes if h.isalnum()}
-    
     def _validate_urls(self, urls: Set[str]) -> Set[str]:
         """Basic URL validation"""
         valid_urls = set()
@@ -182,7 +286,7 @@ class IOCExtractor:
         for url in urls:
             # Skip URLs with benign domains
             url_lower = url.lower()
-            if any(domain in url_lower for domain in self.BENIGN_DOMAINS):
+            if self.benign_domain_pattern.search(url_lower):
                 continue
             
             # Basic sanity check
@@ -223,3 +327,13 @@ def extract_iocs(text: str) -> Dict[str, List[str]]:
         Dictionary of IOC types and values
     """
     return ioc_extractor.extract_all(text)
+
+
+if __name__ == "__main__":
+    # Regression check: matches must not start inside a non-ASCII word
+    for sample, bogus in (("p\u0430ypal.com", "ypal.com"), ("m\u00fcller.de", "ller.de"),
+                          ("j\u00fcrgen@firma.de", "rgen@firma.de"),
+                          ("stra\u00dfe-shop.com", "e-shop.com"), ("\u00e9" + "a" * 32, "a" * 32)):
+        found = [ioc for iocs in extract_iocs(sample).values() for ioc in iocs]
+        assert bogus not in found, f"{sample!r} yielded {found}"
+    print("✅ ioc_extractor self-check passed")
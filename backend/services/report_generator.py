@@ -2,21 +2,312 @@
 report_generator.py - Threat Intelligence Report Generation Service
 Generates exportable reports in CSV, JSON, and HTML formats for SOC teams
 """
+import asyncio
 import csv
+import functools
+import inspect
 import json
 import io
-from typing import Dict, List, Optional
+import time
+from typing import AsyncIterator, Dict, List, Optional
 from datetime import datetime, timedelta
+from jinja2 import Environment
 from motor.motor_asyncio import AsyncIOMotorClient
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Columns written to CSV reports
+CSV_FIELDNAMES = [
+    'ioc_value', 'ioc_type', 'severity', 'severity_score',
+    'malware_family', 'vt_detections', 'abuse_score',
+    'source', 'first_seen', 'description'
+]
+CSV_PROJECTION = {**{field: 1 for field in CSV_FIELDNAMES}, '_id': 0}
+
+# Fields read when formatting CEF and Syslog events
+SIEM_EXPORT_PROJECTION = {
+    'ioc_value': 1,
+    'ioc_type': 1,
+    'severity': 1,
+    'severity_score': 1,
+    'malware_family': 1,
+    'vt_detections': 1,
+    'first_seen': 1,
+    '_id': 0
+}
+
+# Severity levels included in the actionable blocklist when no filter is given
+BLOCKLIST_DEFAULT_SEVERITIES = ('CRITICAL', 'HIGH')
+
+# CEF severity (0-10) for each IOC severity level
+CEF_SEVERITY_MAP = {'CRITICAL': 10, 'HIGH': 7, 'MEDIUM': 5, 'LOW': 3, 'UNKNOWN': 1}
+
+# Short-lived cache for frequently polled reports. Routers create a new
+# ReportGenerator per request, so the cache lives at module level. A result is
+# only stored if no invalidation happened while it was being computed.
+REPORT_CACHE_TTL_SECONDS = 30
+REPORT_CACHE_MAX_ENTRIES = 8
+_report_cache = {}
+_report_cache_version = 0
+
+
+def invalidate_report_cache():
+    """Drop cached report results (call after new IOCs have been ingested)"""
+    global _report_cache_version
+    _report_cache_version += 1
+    _report_cache.clear()
+
+
+def _ttl_cached(**none_defaults):
+    """
+    Cache an async ReportGenerator method's result for REPORT_CACHE_TTL_SECONDS
+    
+    Args:
+        **none_defaults: Effective value of parameters whose None default the
+            method replaces, so omitted, None and explicit calls share a key
+    """
+    def decorator(method):
+        signature = inspect.signature(method)
+        
+        def cache_key(self, args, kwargs):
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            values = []
+            for name, value in list(bound.arguments.items())[1:]:
+                if value is None and name in none_defaults:
+                    value = none_defaults[name]
+                if isinstance(value, (list, tuple)):
+                    value = tuple(sorted(set(value)))
+                values.append(value)
+            return (method.__name__, self.db.name, *values)
+        
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            version = _report_cache_version
+            key = cache_key(self, args, kwargs)
+            cached = _report_cache.get(key)
+            if cached and cached[0] > time.monotonic():
+                return cached[1]
+            
+            result = await method(self, *args, **kwargs)
+            if version != _report_cache_version:
+                return result
+            
+            # Evict expired entries, then the oldest ones, to stay within the cap
+            now = time.monotonic()
+            for stale in [k for k, v in _report_cache.items() if v[0] <= now]:
+                del _report_cache[stale]
+            _report_cache.pop(key, None)
+            while len(_report_cache) >= REPORT_CACHE_MAX_ENTRIES:
+                del _report_cache[next(iter(_report_cache))]
+            _report_cache[key] = (now + REPORT_CACHE_TTL_SECONDS, result)
+            return result
+        
+        return wrapper
+    
+    return decorator
+
+
+# HTML report template, compiled once at import; autoescape keeps IOC values
+# such as URLs containing '<' from injecting markup
+_html_env = Environment(autoescape=True)
+_html_env.filters['thousands'] = '{:,}'.format
+HTML_REPORT_TEMPLATE = _html_env.from_string("""<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>SecInt v2 - Threat Intelligence Report</title>
+    <style>
+        body {
+            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
+            margin: 0;
+            padding: 20px;
+            background: #1a1a1a;
+            color: #e0e0e0;
+        }
+        .container {
+            max-width: 1200px;
+            margin: 0 auto;
+            background: #2a2a2a;
+            padding: 30px;
+            border-radius: 10px;
+            box-shadow: 0 4px 6px rgba(0,0,0,0.3);
+        }
+        h1 {
+            color: #4CAF50;
+            border-bottom: 3px solid #4CAF50;
+            padding-bottom: 10px;
+        }
+        h2 {
+            color: #2196F3;
+            margin-top: 30px;
+        }
+        .metric-grid {
+            display: grid;
+            grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
+            gap: 20px;
+            margin: 20px 0;
+        }
+        .metric-card {
+            background: #3a3a3a;
+            padding: 20px;
+            border-radius: 8px;
+            border-left: 4px solid #4CAF50;
+        }
+        .metric-card.critical { border-left-color: #f44336; }
+        .metric-card.high { border-left-color: #ff9800; }
+        .metric-card.medium { border-left-color: #ffc107; }
+        .metric-card.low { border-left-color: #4CAF50; }
+        .metric-value {
+            font-size: 32px;
+            font-weight: bold;
+            margin: 10px 0;
+        }
+        .metric-label {
+            font-size: 14px;
+            color: #999;
+        }
+        table {
+            width: 100%;
+            border-collapse: collapse;
+            margin: 20px 0;
+            background: #3a3a3a;
+        }
+        th {
+            background: #4CAF50;
+            color: white;
+            padding: 12px;
+            text-align: left;
+        }
+        td {
+            padding: 10px;
+            border-bottom: 1px solid #555;
+        }
+        tr:hover {
+            background: #444;
+        }
+        .severity-badge {
+            padding: 4px 8px;
+            border-radius: 4px;
+            font-size: 12px;
+            font-weight: bold;
+        }
+        .severity-CRITICAL { background: #f44336; color: white; }
+        .severity-HIGH { background: #ff9800; color: white; }
+        .severity-MEDIUM { background: #ffc107; color: black; }
+        .severity-LOW { background: #4CAF50; color: white; }
+        .footer {
+            margin-top: 40px;
+            padding-top: 20px;
+            border-top: 1px solid #555;
+            text-align: center;
+            color: #999;
+            font-size: 12px;
+        }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <h1>🛡️ SecInt v2 - Threat Intelligence Report</h1>
+        <p><strong>Generated:</strong> {{ summary.generated_at }}</p>
+        <p><strong>Overall Threat Level:</strong> <span style="color: #f44336; font-weight: bold;">{{ summary.threat_score }}</span></p>
+        
+        <h2>📊 Executive Summary</h2>
+        <div class="metric-grid">
+            <div class="metric-card">
+                <div class="metric-label">Total IOCs</div>
+                <div class="metric-value">{{ summary.total_iocs | thousands }}</div>
+            </div>
+            <div class="metric-card critical">
+                <div class="metric-label">Critical Threats</div>
+                <div class="metric-value">{{ summary.severity_distribution.CRITICAL | thousands }}</div>
+            </div>
+            <div class="metric-card high">
+                <div class="metric-label">High Severity</div>
+                <div class="metric-value">{{ summary.severity_distribution.HIGH | thousands }}</div>
+            </div>
+            <div class="metric-card medium">
+                <div class="metric-label">Medium Severity</div>
+                <div class="metric-value">{{ summary.severity_distribution.MEDIUM | thousands }}</div>
+            </div>
+            <div class="metric-card low">
+                <div class="metric-label">Low Severity</div>
+                <div class="metric-value">{{ summary.severity_distribution.LOW | thousands }}</div>
+            </div>
+            <div class="metric-card">
+                <div class="metric-label">Recent Threats (24h)</div>
+                <div class="metric-value">{{ summary.recent_threats_24h | thousands }}</div>
+            </div>
+        </div>
+        
+        <h2>🦠 Top Malware Families</h2>
+        <table>
+            <thead>
+                <tr>
+                    <th>Malware Family</th>
+                    <th>Count</th>
+                </tr>
+            </thead>
+            <tbody>
+                {% for m in summary.top_malware_families[:10] %}
+                <tr><td>{{ m.family }}</td><td>{{ m.count }}</td></tr>
+                {% endfor %}
+            </tbody>
+        </table>
+        
+        <h2>🚨 Top 20 Threats to Investigate</h2>
+        <table>
+            <thead>
+                <tr>
+                    <th>IOC Value</th>
+                    <th>Type</th>
+                    <th>Severity</th>
+                    <th>Score</th>
+                    <th>Malware Family</th>
+                    <th>VT Detections</th>
+                </tr>
+            </thead>
+            <tbody>
+                {% for value, ioc_type, badge, severity, score, family, vt in threats %}
+                <tr>
+                    <td><code>{{ value }}</code></td>
+                    <td>{{ ioc_type }}</td>
+                    <td><span class="severity-badge severity-{{ badge }}">{{ severity }}</span></td>
+                    <td>{{ score }}</td>
+                    <td>{{ family }}</td>
+                    <td>{{ vt }}</td>
+                </tr>
+                {% endfor %}
+            </tbody>
+        </table>
+        
+        <div class="footer">
+            <p>SecInt v2 - Real-Time Threat Intelligence Platform | Generated by Report Generator Service</p>
+            <p>⚠️ This report contains sensitive threat intelligence data. Handle according to your organization's security policies.</p>
+        </div>
+    </div>
+</body>
+</html>
+""")
+
 
 class ReportGenerator:
     """Generate threat intelligence reports in multiple formats"""
     
+    # Rows per chunk yielded by stream_csv_report
+    CSV_CHUNK_ROWS = 1000
+    # Documents per getMore while streaming CSV; bounds memory while keeping
+    # round-trips to a handful for typical export limits
+    CSV_CURSOR_BATCH_SIZE = 500
+    
+    # Materialized executive summary document, refreshed in the background
+    SUMMARY_COLLECTION = 'iocs_summary'
+    SUMMARY_DOC_ID = 'current'
+    SUMMARY_REFRESH_SECONDS = 60
+    
     def __init__(self, db_client: AsyncIOMotorClient, db_name: str = "secint"):
         """
         Initialize report generator
@@ -28,45 +319,101 @@ class ReportGenerator:
         self.db = db_client[db_name]
         self.iocs_collection = self.db['iocs']
     
-    async def generate_executive_summary(self) -> Dict:
+    async def ensure_indexes(self):
         """
-        Generate executive summary statistics
+        Create the indexes used by report queries (no-op if they already exist)
+        """
+        # Severity-filtered exports sorted by score; the severity prefix also
+        # serves plain severity filters such as the blocklist $match
+        await self.iocs_collection.create_index([('severity', 1), ('severity_score', -1)])
+        # Unfiltered top-threat and export queries sorted by score
+        await self.iocs_collection.create_index([('severity_score', -1)])
+    
+    def _summary_pipeline(self) -> List[Dict]:
+        """
+        Build the aggregation computing every executive summary metric at once
         
         Returns:
-            Dictionary with key metrics
+            Pipeline producing a single document with one array per metric
         """
-        # Total IOCs
-        total_iocs = await self.iocs_collection.count_documents({})
-        
-        # Critical and High severity counts
-        critical_count = await self.iocs_collection.count_documents({'severity': 'CRITICAL'})
-        high_count = await self.iocs_collection.count_documents({'severity': 'HIGH'})
-        medium_count = await self.iocs_collection.count_documents({'severity': 'MEDIUM'})
-        low_count = await self.iocs_collection.count_documents({'severity': 'LOW'})
-        
-        # Recent threats (last 24 hours)
+        # Recent threats window (last 24 hours)
         cutoff_time = datetime.utcnow() - timedelta(hours=24)
-        recent_count = await self.iocs_collection.count_documents({
-            'first_seen': {'$gte': cutoff_time}
-        })
-        
-        # Top malware families
-        malware_pipeline = [
-            {'$match': {'malware_family': {'$ne': None, '$exists': True}}},
-            {'$group': {'_id': '$malware_family', 'count': {'$sum': 1}}},
-            {'$sort': {'count': -1}},
-            {'$limit': 10}
-        ]
-        malware_cursor = self.iocs_collection.aggregate(malware_pipeline)
-        top_malware = [{'family': doc['_id'], 'count': doc['count']} async for doc in malware_cursor]
         
-        # IOC type distribution
-        type_pipeline = [
-            {'$group': {'_id': '$ioc_type', 'count': {'$sum': 1}}},
-            {'$sort': {'count': -1}}
+        return [
+            {'$facet': {
+                'total': [{'$count': 'count'}],
+                'severity': [
+                    {'$group': {'_id': '$severity', 'count': {'$sum': 1}}}
+                ],
+                'recent': [
+                    {'$match': {'first_seen': {'$gte': cutoff_time}}},
+                    {'$count': 'count'}
+                ],
+                'top_malware': [
+                    {'$match': {'malware_family': {'$ne': None, '$exists': True}}},
+                    {'$group': {'_id': '$malware_family', 'count': {'$sum': 1}}},
+                    {'$sort': {'count': -1}},
+                    {'$limit': 10}
+                ],
+                'ioc_types': [
+                    {'$group': {'_id': '$ioc_type', 'count': {'$sum': 1}}},
+                    {'$sort': {'count': -1}}
+                ]
+            }}
+        ]
+    
+    async def refresh_summary(self):
+        """
+        Recompute the summary metrics and store them in the summary collection
+        """
+        pipeline = self._summary_pipeline() + [
+            {'$set': {'_id': self.SUMMARY_DOC_ID, 'refreshed_at': datetime.utcnow()}},
+            {'$merge': {
+                'into': self.SUMMARY_COLLECTION,
+                'whenMatched': 'replace',
+                'whenNotMatched': 'insert'
+            }}
         ]
-        type_cursor = self.iocs_collection.aggregate(type_pipeline)
-        ioc_types = {doc['_id']: doc['count'] async for doc in type_cursor}
+        await self.iocs_collection.aggregate(pipeline).to_list(length=None)
+    
+    async def run_summary_refresher(self):
+        """
+        Refresh the materialized summary every SUMMARY_REFRESH_SECONDS until cancelled
+        """
+        while True:
+            try:
+                await self.refresh_summary()
+            except Exception as e:
+                logger.error(f"❌ Failed to refresh executive summary: {e}")
+            await asyncio.sleep(self.SUMMARY_REFRESH_SECONDS)
+    
+    @_ttl_cached()
+    async def generate_executive_summary(self) -> Dict:
+        """
+        Generate executive summary statistics
+        
+        Reads the materialized summary kept by refresh_summary, falling back to
+        a live aggregation when it has not been built yet or has gone stale
+        (e.g. the refresher is failing or not running in this process).
+        
+        Returns:
+            Dictionary with key metrics
+        """
+        facets = await self.db[self.SUMMARY_COLLECTION].find_one({'_id': self.SUMMARY_DOC_ID})
+        stale_before = datetime.utcnow() - timedelta(seconds=2 * self.SUMMARY_REFRESH_SECONDS)
+        if facets is None or facets.get('refreshed_at', datetime.min) < stale_before:
+            facets = (await self.iocs_collection.aggregate(self._summary_pipeline()).to_list(length=1))[0]
+        
+        total_iocs = facets['total'][0]['count'] if facets['total'] else 0
+        recent_count = facets['recent'][0]['count'] if facets['recent'] else 0
+        severity_counts = {doc['_id']: doc['count'] for doc in facets['severity']}
+        critical_count = severity_counts.get('CRITICAL', 0)
+        high_count = severity_counts.get('HIGH', 0)
+        medium_count = severity_counts.get('MEDIUM', 0)
+        low_count = severity_counts.get('LOW', 0)
+        top_malware = [{'family': doc['_id'], 'count': doc['count']} for doc in facets['top_malware']]
+        # Documents without an ioc_type group under None; keep every key a string
+        ioc_types = {str(doc['_id'] or 'unknown'): doc['count'] for doc in facets['ioc_types']}
         
         return {
             'generated_at': datetime.utcnow().isoformat(),
@@ -131,15 +478,10 @@ class ReportGenerator:
             }
         ).sort('severity_score', -1).limit(limit)
         
-        threats = await cursor.to_list(length=limit)
-        
-        # Convert datetime to string
-        for threat in threats:
-            if 'first_seen' in threat and isinstance(threat['first_seen'], datetime):
-                threat['first_seen'] = threat['first_seen'].isoformat()
-        
-        return threats
+        # first_seen stays a datetime; the JSON responses serialize it natively
+        return await cursor.to_list(length=limit)
     
+    @_ttl_cached(severity_filter=BLOCKLIST_DEFAULT_SEVERITIES)
     async def get_actionable_blocklist(self, severity_filter: List[str] = None) -> Dict[str, List[str]]:
         """
         Get actionable blocklist for firewall/SIEM integration
@@ -151,21 +493,24 @@ class ReportGenerator:
             Dictionary with IPs, domains, and URLs to block
         """
         if severity_filter is None:
-            severity_filter = ['CRITICAL', 'HIGH']
+            severity_filter = list(BLOCKLIST_DEFAULT_SEVERITIES)
         
         # Query for high-priority IOCs
         query = {'severity': {'$in': severity_filter}}
         
-        # Aggregate by IOC type
+        # Deduplicate (type, value) pairs and sort values on the server, then
+        # collect one sorted array per IOC type ($push keeps the sort order)
         pipeline = [
             {'$match': query},
+            {'$group': {'_id': {'ioc_type': '$ioc_type', 'ioc_value': '$ioc_value'}}},
+            {'$sort': {'_id.ioc_value': 1}},
             {'$group': {
-                '_id': '$ioc_type',
-                'values': {'$addToSet': '$ioc_value'}
+                '_id': '$_id.ioc_type',
+                'values': {'$push': '$_id.ioc_value'}
             }}
         ]
         
-        cursor = self.iocs_collection.aggregate(pipeline)
+        cursor = self.iocs_collection.aggregate(pipeline, allowDiskUse=True)
         results = {doc['_id']: doc['values'] async for doc in cursor}
         
         # Organize by category
@@ -185,42 +530,67 @@ class ReportGenerator:
         
         return blocklist
     
-    async def generate_csv_report(self, severity_filter: List[str] = None, limit: int = 1000) -> str:
+    @staticmethod
+    async def _prepend(first: Dict, rest: AsyncIterator[Dict]) -> AsyncIterator[Dict]:
+        """Yield an already-fetched document followed by the rest of a cursor"""
+        yield first
+        async for doc in rest:
+            yield doc
+    
+    async def stream_csv_report(self, severity_filter: List[str] = None, limit: int = 1000) -> AsyncIterator[str]:
         """
-        Generate CSV format report
+        Stream CSV format report in chunks as IOCs arrive from MongoDB
         
         Args:
             severity_filter: Filter by severity levels
             limit: Maximum records
             
-        Returns:
-            CSV string
+        Yields:
+            CSV text chunks (header first, then up to CSV_CHUNK_ROWS rows each)
         """
         query = {}
         if severity_filter:
             query['severity'] = {'$in': severity_filter}
         
-        cursor = self.iocs_collection.find(query).sort('severity_score', -1).limit(limit)
-        iocs = await cursor.to_list(length=limit)
+        cursor = (
+            self.iocs_collection.find(query, CSV_PROJECTION)
+            .sort('severity_score', -1)
+            .limit(limit)
+            .batch_size(self.CSV_CURSOR_BATCH_SIZE)
+        )
         
-        # Generate CSV
-        output = io.StringIO()
-        fieldnames = [
-            'ioc_value', 'ioc_type', 'severity', 'severity_score',
-            'malware_family', 'vt_detections', 'abuse_score',
-            'source', 'first_seen', 'description'
-        ]
+        # Run the query before the first chunk is yielded so callers that prime
+        # the stream see query errors before the response has started
+        first_ioc = await anext(cursor, None)
         
-        writer = csv.DictWriter(output, fieldnames=fieldnames, extrasaction='ignore')
+        # Reuse one small buffer per chunk instead of holding the whole report
+        output = io.StringIO()
+        writer = csv.DictWriter(output, fieldnames=CSV_FIELDNAMES, extrasaction='ignore')
         writer.writeheader()
-        
-        for ioc in iocs:
+        yield output.getvalue()
+        output.seek(0)
+        output.truncate(0)
+        if first_ioc is None:
+            return
+        
+        # Write rows in CSV_CHUNK_ROWS batches with a single writerows call each
+        batch = []
+        async for ioc in self._prepend(first_ioc, cursor):
             # Convert datetime to string
             if 'first_seen' in ioc and isinstance(ioc['first_seen'], datetime):
                 ioc['first_seen'] = ioc['first_seen'].isoformat()
-            writer.writerow(ioc)
-        
-        return output.getvalue()
+            batch.append(ioc)
+            
+            if len(batch) == self.CSV_CHUNK_ROWS:
+                writer.writerows(batch)
+                batch.clear()
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate(0)
+        
+        if batch:
+            writer.writerows(batch)
+            yield output.getvalue()
     
     async def generate_json_report(self, include_summary: bool = True) -> Dict:
         """
@@ -230,27 +600,38 @@ class ReportGenerator:
             include_summary: Include executive summary
             
         Returns:
-            JSON-serializable dictionary
+            Dictionary serializable with orjson (datetimes are left as-is)
         """
         report = {
             'report_metadata': {
-                'generated_at': datetime.utcnow().isoformat(),
+                'generated_at': datetime.utcnow(),
                 'report_type': 'threat_intelligence',
                 'version': '2.0'
             }
         }
         
+        # Summary, top threats and blocklist are independent queries; run them concurrently
+        queries = [
+            self.get_top_threats(limit=50),
+            self.get_actionable_blocklist()
+        ]
         if include_summary:
-            report['executive_summary'] = await self.generate_executive_summary()
+            queries.append(self.generate_executive_summary())
+        
+        top_threats, blocklist, *summary = await asyncio.gather(*queries)
+        
+        if summary:
+            report['executive_summary'] = summary[0]
         
         # Top threats
-        report['top_threats'] = await self.get_top_threats(limit=50)
+        report['top_threats'] = top_threats
         
         # Actionable blocklist
-        report['actionable_blocklist'] = await self.get_actionable_blocklist()
+        report['actionable_blocklist'] = blocklist
         
         return report
     
+    @_ttl_cached()
     async def generate_html_report(self) -> str:
         """
         Generate HTML format report for viewing in browser
@@ -258,185 +639,26 @@ class ReportGenerator:
         Returns:
             HTML string
         """
-        summary = await self.generate_executive_summary()
-        top_threats = await self.get_top_threats(limit=20)
-        
-        html = f"""
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>SecInt v2 - Threat Intelligence Report</title>
-    <style>
-        body {{
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            margin: 0;
-            padding: 20px;
-            background: #1a1a1a;
-            color: #e0e0e0;
-        }}
-        .container {{
-            max-width: 1200px;
-            margin: 0 auto;
-            background: #2a2a2a;
-            padding: 30px;
-            border-radius: 10px;
-            box-shadow: 0 4px 6px rgba(0,0,0,0.3);
-        }}
-        h1 {{
-            color: #4CAF50;
-            border-bottom: 3px solid #4CAF50;
-            padding-bottom: 10px;
-        }}
-        h2 {{
-            color: #2196F3;
-            margin-top: 30px;
-        }}
-        .metric-grid {{
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
-            gap: 20px;
-            margin: 20px 0;
-        }}
-        .metric-card {{
-            background: #3a3a3a;
-            padding: 20px;
-            border-radius: 8px;
-            border-left: 4px solid #4CAF50;
-        }}
-        .metric-card.critical {{ border-left-color: #f44336; }}
-        .metric-card.high {{ border-left-color: #ff9800; }}
-        .metric-card.medium {{ border-left-color: #ffc107; }}
-        .metric-card.low {{ border-left-color: #4CAF50; }}
-        .metric-value {{
-            font-size: 32px;
-            font-weight: bold;
-            margin: 10px 0;
-        }}
-        .metric-label {{
-            font-size: 14px;
-            color: #999;
-        }}
-        table {{
-            width: 100%;
-            border-collapse: collapse;
-            margin: 20px 0;
-            background: #3a3a3a;
-        }}
-        th {{
-            background: #4CAF50;
-            color: white;
-            padding: 12px;
-            text-align: left;
-        }}
-        td {{
-            padding: 10px;
-            border-bottom: 1px solid #555;
-        }}
-        tr:hover {{
-            background: #444;
-        }}
-        .severity-badge {{
-            padding: 4px 8px;
-            border-radius: 4px;
-            font-size: 12px;
-            font-weight: bold;
-        }}
-        .severity-CRITICAL {{ background: #f44336; color: white; }}
-        .severity-HIGH {{ background: #ff9800; color: white; }}
-        .severity-MEDIUM {{ background: #ffc107; color: black; }}
-        .severity-LOW {{ background: #4CAF50; color: white; }}
-        .footer {{
-            margin-top: 40px;
-            padding-top: 20px;
-            border-top: 1px solid #555;
-            text-align: center;
-            color: #999;
-            font-size: 12px;
-        }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>🛡️ SecInt v2 - Threat Intelligence Report</h1>
-        <p><strong>Generated:</strong> {summary['generated_at']}</p>
-        <p><strong>Overall Threat Level:</strong> <span style="color: #f44336; font-weight: bold;">{summary['threat_score']}</span></p>
-        
-        <h2>📊 Executive Summary</h2>
-        <div class="metric-grid">
-            <div class="metric-card">
-                <div class="metric-label">Total IOCs</div>
-                <div class="metric-value">{summary['total_iocs']:,}</div>
-            </div>
-            <div class="metric-card critical">
-                <div class="metric-label">Critical Threats</div>
-                <div class="metric-value">{summary['severity_distribution']['CRITICAL']:,}</div>
-            </div>
-            <div class="metric-card high">
-                <div class="metric-label">High Severity</div>
-                <div class="metric-value">{summary['severity_distribution']['HIGH']:,}</div>
-            </div>
-            <div class="metric-card medium">
-                <div class="metric-label">Medium Severity</div>
-                <div class="metric-value">{summary['severity_distribution']['MEDIUM']:,}</div>
-            </div>
-            <div class="metric-card low">
-                <div class="metric-label">Low Severity</div>
-                <div class="metric-value">{summary['severity_distribution']['LOW']:,}</div>
-            </div>
-            <div class="metric-card">
-                <div class="metric-label">Recent Threats (24h)</div>
-                <div class="metric-value">{summary['recent_threats_24h']:,}</div>
-            </div>
-        </div>
-        
-        <h2>🦠 Top Malware Families</h2>
-        <table>
-            <thead>
-                <tr>
-                    <th>Malware Family</th>
-                    <th>Count</th>
-                </tr>
-            </thead>
-            <tbody>
-                {''.join([f'<tr><td>{m["family"]}</td><td>{m["count"]}</td></tr>' for m in summary['top_malware_families'][:10]])}
-            </tbody>
-        </table>
-        
-        <h2>🚨 Top 20 Threats to Investigate</h2>
-        <table>
-            <thead>
-                <tr>
-                    <th>IOC Value</th>
-                    <th>Type</th>
-                    <th>Severity</th>
-                    <th>Score</th>
-                    <th>Malware Family</th>
-                    <th>VT Detections</th>
-                </tr>
-            </thead>
-            <tbody>
-                {''.join([f'''<tr>
-                    <td><code>{t.get('ioc_value', 'N/A')}</code></td>
-                    <td>{t.get('ioc_type', 'N/A')}</td>
-                    <td><span class="severity-badge severity-{t.get('severity', 'LOW')}">{t.get('severity', 'N/A')}</span></td>
-                    <td>{t.get('severity_score', 0)}</td>
-                    <td>{t.get('malware_family', 'Unknown')}</td>
-                    <td>{t.get('vt_detections', 'N/A')}</td>
-                </tr>''' for t in top_threats])}
-            </tbody>
-        </table>
+        summary, top_threats = await asyncio.gather(
+            self.generate_executive_summary(),
+            self.get_top_threats(limit=20)
+        )
+        
+        # Resolve cell values once into tuples; the template only unpacks them
+        rows = [
+            (
+                t.get('ioc_value', 'N/A'),
+                t.get('ioc_type', 'N/A'),
+                t.get('severity', 'LOW'),
+                t.get('severity', 'N/A'),
+                t.get('severity_score', 0),
+                t.get('malware_family', 'Unknown'),
+                t.get('vt_detections', 'N/A')
+            )
+            for t in top_threats
+        ]
         
-        <div class="footer">
-            <p>SecInt v2 - Real-Time Threat Intelligence Platform | Generated by Report Generator Service</p>
-            <p>⚠️ This report contains sensitive threat intelligence data. Handle according to your organization's security policies.</p>
-        </div>
-    </div>
-</body>
-</html>
-"""
-        return html
+        return HTML_REPORT_TEMPLATE.render(summary=summary, threats=rows)
     
     async def generate_cef_format(self, severity_filter: List[str] = None, limit: int = 500) -> str:
         """
@@ -453,18 +675,26 @@ class ReportGenerator:
         if severity_filter:
             query['severity'] = {'$in': severity_filter}
         
-        cursor = self.iocs_collection.find(query).sort('severity_score', -1).limit(limit)
+        # Everything is materialized anyway, so fetch it in a single batch
+        cursor = (
+            self.iocs_collection.find(query, SIEM_EXPORT_PROJECTION)
+            .sort('severity_score', -1)
+            .limit(limit)
+            .batch_size(limit)
+        )
         iocs = await cursor.to_list(length=limit)
         
+        # Fallback timestamp for IOCs without first_seen, read once per export
+        now = datetime.utcnow()
+        
         cef_events = []
         for ioc in iocs:
             # CEF Format: CEF:Version|Device Vendor|Device Product|Device Version|Signature ID|Name|Severity|Extension
-            timestamp = ioc.get('first_seen', datetime.utcnow())
+            timestamp = ioc.get('first_seen', now)
             if isinstance(timestamp, datetime):
                 timestamp = timestamp.strftime('%b %d %Y %H:%M:%S')
             
-            severity_map = {'CRITICAL': 10, 'HIGH': 7, 'MEDIUM': 5, 'LOW': 3, 'UNKNOWN': 1}
-            cef_severity = severity_map.get(ioc.get('severity', 'UNKNOWN'), 1)
+            cef_severity = CEF_SEVERITY_MAP.get(ioc.get('severity', 'UNKNOWN'), 1)
             
             cef_line = (
                 f"CEF:0|SecInt|ThreatIntel|2.0|{ioc.get('ioc_type', 'unknown')}|"
@@ -495,12 +725,21 @@ class ReportGenerator:
         if severity_filter:
             query['severity'] = {'$in': severity_filter}
         
-        cursor = self.iocs_collection.find(query).sort('severity_score', -1).limit(limit)
+        # Everything is materialized anyway, so fetch it in a single batch
+        cursor = (
+            self.iocs_collection.find(query, SIEM_EXPORT_PROJECTION)
+            .sort('severity_score', -1)
+            .limit(limit)
+            .batch_size(limit)
+        )
         iocs = await cursor.to_list(length=limit)
         
+        # Fallback timestamp for IOCs without first_seen, read once per export
+        now = datetime.utcnow()
+        
         syslog_events = []
         for ioc in iocs:
-            timestamp = ioc.get('first_seen', datetime.utcnow())
+            timestamp = ioc.get('first_seen', now)
             if isinstance(timestamp, datetime):
                 timestamp = timestamp.strftime('%Y-%m-%dT%H:%M:%S')
             
@@ -2,8 +2,12 @@
 severity_scorer.py - Rule-based severity scoring for IOCs
 Assigns CRITICAL/HIGH/MEDIUM/LOW severity based on threat intelligence
 """
-from typing import Dict, Optional
-from datetime import datetime, timedelta
+import re
+import calendar
+from bisect import bisect_right
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+from datetime import datetime
 from enum import Enum
 import logging
 
@@ -17,6 +21,8 @@ class SeverityLevel(str, Enum):
     LOW = "LOW"
     UNKNOWN = "UNKNOWN"
 
+SECONDS_PER_DAY = 86400
+
 class SeverityScorer:
     """Calculate threat severity based on enrichment data and context"""
     
@@ -44,20 +50,50 @@ class SeverityScorer:
         'exploit kit', 'cryptominer'
     }
     
+    # Minimum scores for LOW, MEDIUM, HIGH and CRITICAL; anything lower is UNKNOWN
+    SEVERITY_THRESHOLDS = (1, 20, 45, 70)
+    SEVERITY_LEVELS = (
+        SeverityLevel.UNKNOWN, SeverityLevel.LOW, SeverityLevel.MEDIUM,
+        SeverityLevel.HIGH, SeverityLevel.CRITICAL
+    )
+    
     def __init__(self):
-        """Initialize severity scorer"""
-        pass
+        """Initialize severity scorer with compiled keyword matchers"""
+        self.critical_malware_pattern = self._compile_keywords(self.CRITICAL_MALWARE_FAMILIES)
+        self.high_risk_malware_pattern = self._compile_keywords(self.HIGH_RISK_MALWARE_FAMILIES)
+        self.critical_threat_pattern = self._compile_keywords(self.CRITICAL_THREAT_TYPES)
+    
+    @staticmethod
+    def _compile_keywords(keywords: Iterable[str]) -> re.Pattern:
+        """
+        Compile keywords into one alternation that finds any of them as a substring
+        
+        Args:
+            keywords: Lowercase keywords to match
+            
+        Returns:
+            Compiled regex (longest keywords first so findall reports full names)
+        """
+        # Inputs are lowercased once per call, so the keywords must be lowercase
+        assert all(keyword == keyword.lower() for keyword in keywords)
+        ordered = sorted(keywords, key=len, reverse=True)
+        return re.compile('|'.join(re.escape(keyword) for keyword in ordered))
     
-    def calculate_severity(self, ioc_data: Dict) -> Dict:
+    def calculate_severity(self, ioc_data: Dict, now: Optional[datetime] = None,
+                           now_ts: Optional[int] = None) -> Dict:
         """
         Calculate severity score and level for an IOC
         
         Args:
             ioc_data: Enriched IOC dictionary
+            now: Naive UTC reference time for recency (defaults to current time)
+            now_ts: `now` as epoch seconds; pass it when scoring many IOCs so
+                the first_seen_ts path is a plain integer subtraction
             
         Returns:
             IOC data with added 'severity' and 'severity_score' fields
         """
+        now = now or datetime.utcnow()
         score = 0
         reasons = []
         
@@ -79,10 +115,10 @@ class SeverityScorer:
         # === Malware Family ===
         malware_family = ioc_data.get('malware_family', '').lower()
         if malware_family:
-            if any(critical in malware_family for critical in self.CRITICAL_MALWARE_FAMILIES):
+            if self.critical_malware_pattern.search(malware_family):
                 score += 40
                 reasons.append(f"Critical malware: {malware_family}")
-            elif any(high_risk in malware_family for high_risk in self.HIGH_RISK_MALWARE_FAMILIES):
+            elif self.high_risk_malware_pattern.search(malware_family):
                 score += 25
                 reasons.append(f"High-risk malware: {malware_family}")
             else:
@@ -103,19 +139,26 @@ class SeverityScorer:
                 reasons.append(f"AbuseIPDB confidence: {abuse_score}% (>50%)")
         
         # === Threat Context/Description ===
-        context = ioc_data.get('context', '').lower()
-        threat_type = ioc_data.get('threat_type', '').lower()
-        description = ioc_data.get('description', '').lower()
-        combined_text = f"{context} {threat_type} {description}"
+        context = ioc_data.get('context', '')
+        threat_type = ioc_data.get('threat_type', '')
+        description = ioc_data.get('description', '')
+        combined_text = f"{context} {threat_type} {description}".lower()
         
-        if any(critical in combined_text for critical in self.CRITICAL_THREAT_TYPES):
+        matching_types = list(dict.fromkeys(self.critical_threat_pattern.findall(combined_text)))
+        if matching_types:
             score += 25
-            matching_types = [t for t in self.CRITICAL_THREAT_TYPES if t in combined_text]
             reasons.append(f"Critical threat type: {', '.join(matching_types[:2])}")
         
         # === Recency ===
+        # Prefer the epoch seconds stored at ingest over parsing first_seen
+        age_seconds = None
+        first_seen_ts = ioc_data.get('first_seen_ts')
         first_seen = ioc_data.get('first_seen')
-        if first_seen:
+        if first_seen_ts is not None:
+            if now_ts is None:
+                now_ts = calendar.timegm(now.timetuple())
+            age_seconds = now_ts - first_seen_ts
+        elif first_seen:
             if isinstance(first_seen, str):
                 try:
                     first_seen = datetime.fromisoformat(first_seen.replace('Z', '+00:00'))
@@ -123,13 +166,15 @@ class SeverityScorer:
                     first_seen = None
             
             if first_seen and isinstance(first_seen, datetime):
-                age = datetime.utcnow() - first_seen.replace(tzinfo=None)
-                if age < timedelta(days=7):
-                    score += 15
-                    reasons.append("Recent threat (<7 days)")
-                elif age < timedelta(days=30):
-                    score += 10
-                    reasons.append("Recent threat (<30 days)")
+                age_seconds = (now - first_seen.replace(tzinfo=None)).total_seconds()
+        
+        if age_seconds is not None:
+            if age_seconds < 7 * SECONDS_PER_DAY:
+                score += 15
+                reasons.append("Recent threat (<7 days)")
+            elif age_seconds < 30 * SECONDS_PER_DAY:
+                score += 10
+                reasons.append("Recent threat (<30 days)")
         
         # === URLhaus Specific ===
         if ioc_data.get('source') == 'urlhaus':
@@ -161,16 +206,7 @@ class SeverityScorer:
             reasons.append(f"Confirmed by {num_sources} sources")
         
         # === Determine Severity Level ===
-        if score >= 70:
-            severity = SeverityLevel.CRITICAL
-        elif score >= 45:
-            severity = SeverityLevel.HIGH
-        elif score >= 20:
-            severity = SeverityLevel.MEDIUM
-        elif score > 0:
-            severity = SeverityLevel.LOW
-        else:
-            severity = SeverityLevel.UNKNOWN
+        severity = self.SEVERITY_LEVELS[bisect_right(self.SEVERITY_THRESHOLDS, score)]
         
         # Add to IOC data
         ioc_data['severity'] = severity.value
@@ -179,6 +215,108 @@ class SeverityScorer:
         
         return ioc_data
     
+    def build_rescore_pipeline(self, now: Optional[datetime] = None) -> List[Dict]:
+        """
+        Build an update pipeline that applies the calculate_severity rules in MongoDB
+        
+        Intended for bulk re-scoring with update_many(filter, pipeline) (MongoDB 4.2+).
+        Only 'severity_score' and 'severity' are rewritten; 'severity_reasons' keeps
+        whatever calculate_severity recorded at ingest.
+        
+        Args:
+            now: Naive UTC reference time for recency (defaults to current time)
+            
+        Returns:
+            List of pipeline stages
+        """
+        now = now or datetime.utcnow()
+        
+        def lower(field: str) -> Dict:
+            return {'$toLower': {'$ifNull': [field, '']}}
+        
+        def matches(pattern: re.Pattern, text: Dict) -> Dict:
+            return {'$regexMatch': {'input': text, 'regex': pattern.pattern}}
+        
+        def tiers(branches, default=0) -> Dict:
+            return {'$switch': {
+                'branches': [{'case': case, 'then': then} for case, then in branches],
+                'default': default
+            }}
+        
+        vt_rate = {'$ifNull': ['$vt_detection_rate', 0]}
+        malware_family = lower('$malware_family')
+        abuse_score = {'$ifNull': ['$sources.abuseipdb.abuse_confidence_score', 0]}
+        combined_text = {'$toLower': {'$concat': [
+            {'$ifNull': ['$context', '']}, ' ',
+            {'$ifNull': ['$threat_type', '']}, ' ',
+            {'$ifNull': ['$description', '']}
+        ]}}
+        num_sources = {'$size': {'$objectToArray': {'$ifNull': ['$sources', {}]}}}
+        age = '$_age_seconds'
+        has_age = {'$ne': [age, None]}
+        
+        score_terms = [
+            # VirusTotal detection rate
+            tiers([
+                ({'$gt': [vt_rate, 0.8]}, 50),
+                ({'$gt': [vt_rate, 0.5]}, 30),
+                ({'$gt': [vt_rate, 0.2]}, 15),
+            ]),
+            # Malware family
+            tiers([
+                ({'$eq': [malware_family, '']}, 0),
+                (matches(self.critical_malware_pattern, malware_family), 40),
+                (matches(self.high_risk_malware_pattern, malware_family), 25),
+            ], default=10),
+            # AbuseIPDB score (IPs only)
+            {'$cond': [{'$eq': ['$ioc_type', 'ipv4']}, tiers([
+                ({'$gt': [abuse_score, 90]}, 30),
+                ({'$gt': [abuse_score, 70]}, 20),
+                ({'$gt': [abuse_score, 50]}, 10),
+            ]), 0]},
+            # Threat context/description
+            {'$cond': [matches(self.critical_threat_pattern, combined_text), 25, 0]},
+            # Recency
+            tiers([
+                ({'$and': [has_age, {'$lt': [age, 7 * SECONDS_PER_DAY]}]}, 15),
+                ({'$and': [has_age, {'$lt': [age, 30 * SECONDS_PER_DAY]}]}, 10),
+            ]),
+            # URLhaus specific
+            {'$cond': [{'$eq': ['$source', 'urlhaus']}, {'$add': [
+                {'$cond': [{'$eq': [lower('$url_status'), 'online']}, 20, 0]},
+                {'$cond': [{'$regexMatch': {'input': lower('$threat'), 'regex': 'malware_download'}}, 15, 0]},
+            ]}, 0]},
+            # VirusTotal reputation
+            {'$cond': [{'$lt': [{'$ifNull': ['$sources.virustotal.reputation', 0]}, -50]}, 20, 0]},
+            # Multiple sources
+            tiers([
+                ({'$gte': [num_sources, 3]}, 15),
+                ({'$gte': [num_sources, 2]}, 10),
+            ]),
+        ]
+        
+        # Highest threshold first, mirroring SEVERITY_THRESHOLDS/SEVERITY_LEVELS
+        severity_branches = [
+            ({'$gte': ['$severity_score', threshold]}, level.value)
+            for threshold, level in reversed(list(zip(self.SEVERITY_THRESHOLDS, self.SEVERITY_LEVELS[1:])))
+        ]
+        
+        return [
+            # Age in seconds from first_seen_ts, else first_seen (dates only), else null
+            {'$set': {'_age_seconds': {'$switch': {
+                'branches': [
+                    {'case': {'$in': [{'$type': '$first_seen_ts'}, ['int', 'long', 'double']]},
+                     'then': {'$subtract': [calendar.timegm(now.timetuple()), '$first_seen_ts']}},
+                    {'case': {'$eq': [{'$type': '$first_seen'}, 'date']},
+                     'then': {'$divide': [{'$subtract': [now, '$first_seen']}, 1000]}},
+                ],
+                'default': None
+            }}}},
+            {'$set': {'severity_score': {'$add': score_terms}}},
+            {'$set': {'severity': tiers(severity_branches, default=SeverityLevel.UNKNOWN.value)}},
+            {'$unset': '_age_seconds'},
+        ]
+    
     def calculate_batch_severity(self, iocs: list) -> list:
         """
         Calculate severity for multiple IOCs
@@ -189,19 +327,15 @@ class SeverityScorer:
         Returns:
             List of IOCs with severity scores
         """
-        scored_iocs = []
-        
-        for ioc in iocs:
-            scored_ioc = self.calculate_severity(ioc)
-            scored_iocs.append(scored_ioc)
+        # One clock read for the whole batch
+        now = datetime.utcnow()
+        now_ts = calendar.timegm(now.timetuple())
+        scored_iocs = [self.calculate_severity(ioc, now, now_ts) for ioc in iocs]
         
         logger.info(f"✅ Scored {len(scored_iocs)} IOCs for severity")
         
         # Log severity distribution
-        severity_counts = {}
-        for ioc in scored_iocs:
-            severity = ioc.get('severity', 'UNKNOWN')
-            severity_counts[severity] = severity_counts.get(severity, 0) + 1
+        severity_counts = dict(Counter(ioc['severity'] for ioc in scored_iocs))
         
         logger.info(f"📊 Severity distribution: {severity_counts}")
         
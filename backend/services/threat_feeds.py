@@ -4,17 +4,79 @@ Pulls live IOCs from AlienVault OTX, AbuseIPDB, URLhaus, and VirusTotal
 """
 import os
 import asyncio
-import aiohttp
-from typing import List, Dict, Optional
+import functools
+import random
+import time
+import httpx
+import ijson
+import orjson
+from typing import List, Dict, Optional, Tuple
 from datetime import datetime, timedelta
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Reputation lookup cache: (method, indicator) -> (expires_at, payload).
+# Only successful answers and VirusTotal "not found" are cached; errors and
+# rate-limit responses are retried on the next call.
+LOOKUP_CACHE_TTL_SECONDS = 3600
+NEGATIVE_CACHE_TTL_SECONDS = 600
+LOOKUP_CACHE_MAX_ENTRIES = 50_000
+_lookup_cache = {}
+_NOT_FOUND = object()
+
+
+def _lookup_cache_get(key):
+    """Return an unexpired cached payload (possibly _NOT_FOUND), or None on a miss"""
+    cached = _lookup_cache.get(key)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    return None
+
+
+def _lookup_cache_put(key, payload):
+    """Cache a payload, pruning expired entries first when the cache is full"""
+    now = time.monotonic()
+    if len(_lookup_cache) >= LOOKUP_CACHE_MAX_ENTRIES:
+        for stale in [k for k, v in _lookup_cache.items() if v[0] <= now]:
+            del _lookup_cache[stale]
+        if len(_lookup_cache) >= LOOKUP_CACHE_MAX_ENTRIES:
+            _lookup_cache.clear()
+    ttl = NEGATIVE_CACHE_TTL_SECONDS if payload is _NOT_FOUND else LOOKUP_CACHE_TTL_SECONDS
+    _lookup_cache[key] = (now + ttl, payload)
+
+
+def _ttl_cached_lookup(method):
+    """Cache an async check_* method's result per indicator for LOOKUP_CACHE_TTL_SECONDS"""
+    @functools.wraps(method)
+    async def wrapper(self, indicator):
+        key = (method.__name__, indicator)
+        payload = _lookup_cache_get(key)
+        if payload is None:
+            payload = await method(self, indicator)
+            if payload is not None:
+                _lookup_cache_put(key, payload)
+        return None if payload is _NOT_FOUND else payload
+    
+    return wrapper
+
 class ThreatFeedAggregator:
     """Aggregate threat intelligence from multiple sources"""
     
+    # Bytes read per network chunk when streaming large feed responses
+    STREAM_CHUNK_SIZE = 65536
+    
+    # check_ips switches to one AbuseIPDB /check-block call per /24 once a
+    # subnet holds at least this many of the requested IPs
+    CHECK_BLOCK_MIN_IPS = 3
+    
+    # Retry policy for reputation lookups (exponential backoff with jitter)
+    RETRY_ATTEMPTS = 4
+    RETRY_BASE_DELAY = 1.0
+    RETRY_MAX_DELAY = 30.0
+    RETRY_STATUSES = frozenset({429, 502, 503})
+    
     def __init__(self):
         """Initialize with API keys from environment"""
         self.otx_api_key = os.getenv('OTX_API_KEY')
@@ -27,6 +89,123 @@ class ThreatFeedAggregator:
         self.abuseipdb_base = 'https://api.abuseipdb.com/api/v2'
         self.urlhaus_base = 'https://urlhaus-api.abuse.ch/v1'
         self.virustotal_base = 'https://www.virustotal.com/api/v3'
+        
+        # Shared HTTP/2 client (connection pooling, multiplexing, keep-alive)
+        self._client: Optional[httpx.AsyncClient] = None
+        
+        # Per-provider caps on in-flight requests (strict API quotas)
+        self._sem_vt = asyncio.Semaphore(4)
+        self._sem_abuse = asyncio.Semaphore(2)
+    
+    async def _get_client(self) -> httpx.AsyncClient:
+        """
+        Get the shared HTTP client, creating it on first use
+        
+        Returns:
+            Long-lived HTTP/2 client reused across all feed requests
+        """
+        if self._client is None or self._client.is_closed:
+            # gzip/deflate/br response decoding is negotiated by httpx itself
+            self._client = httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(
+                    max_connections=100,
+                    max_keepalive_connections=20,
+                    keepalive_expiry=60
+                ),
+                timeout=30.0
+            )
+        return self._client
+    
+    async def aclose(self):
+        """Close the shared HTTP client (call on shutdown)"""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+    
+    async def _get_with_retry(self, url: str, **kwargs) -> httpx.Response:
+        """
+        GET a URL, retrying connection errors and 429/502/503 responses
+        
+        Waits follow exponential backoff with jitter, or the server's
+        Retry-After header when present (capped at RETRY_MAX_DELAY).
+        
+        Args:
+            url: Request URL
+            **kwargs: Passed through to client.get()
+            
+        Returns:
+            Final response with its body already read
+        """
+        client = await self._get_client()
+        for attempt in range(1, self.RETRY_ATTEMPTS + 1):
+            delay = min(self.RETRY_MAX_DELAY, self.RETRY_BASE_DELAY * 2 ** (attempt - 1)) + random.uniform(0, 1)
+            try:
+                response = await client.get(url, **kwargs)
+            except httpx.TransportError:
+                if attempt == self.RETRY_ATTEMPTS:
+                    raise
+            else:
+                if response.status_code not in self.RETRY_STATUSES or attempt == self.RETRY_ATTEMPTS:
+                    return response
+                try:
+                    delay = min(self.RETRY_MAX_DELAY, float(response.headers['Retry-After']))
+                except (KeyError, ValueError):
+                    pass
+                logger.warning(f"⚠️ HTTP {response.status_code} from {response.url.host}, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+    
+    async def _stream_feed_items(self, response: httpx.Response, key: str,
+                                 limit: int) -> Tuple[Optional[str], List[Dict]]:
+        """
+        Incrementally parse a URLhaus-style {"query_status": ..., key: [...]} body
+        
+        Items are built as the bytes arrive and reading stops as soon as
+        `limit` items are collected, so the full array is never buffered.
+        
+        Args:
+            response: Streaming httpx response with an unread body
+            key: Name of the top-level array holding the items
+            limit: Maximum number of items to collect
+            
+        Returns:
+            Tuple of (query_status, items)
+        """
+        events = ijson.sendable_list()
+        parser = ijson.parse_coro(events, use_float=True)
+        item_prefix = f"{key}.item"
+        status: Optional[str] = None
+        items: List[Dict] = []
+        builder = None
+        
+        def consume() -> bool:
+            nonlocal status, builder
+            for prefix, event, value in events:
+                if prefix == 'query_status':
+                    status = value
+                    continue
+                if prefix == item_prefix and event == 'start_map':
+                    builder = ijson.ObjectBuilder()
+                if builder is None:
+                    continue
+                builder.event(event, value)
+                if prefix == item_prefix and event == 'end_map':
+                    items.append(builder.value)
+                    builder = None
+                    if len(items) >= limit:
+                        return True
+            del events[:]
+            return False
+        
+        if limit > 0:
+            async for chunk in response.aiter_bytes(self.STREAM_CHUNK_SIZE):
+                parser.send(chunk)
+                if consume():
+                    # Leaving early drops the rest of the body with the connection
+                    return status, items
+            parser.close()
+            consume()
+        return status, items
     
     async def fetch_otx_pulses(self, limit: int = 50) -> List[Dict]:
         """
@@ -47,16 +226,16 @@ class ThreatFeedAggregator:
         params = {'limit': limit, 'page': 1}
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers, params=params, timeout=30) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        pulses = data.get('results', [])
-                        logger.info(f"✅ Fetched {len(pulses)} threat pulses from OTX")
-                        return pulses
-                    else:
-                        logger.error(f"❌ OTX API error: {response.status}")
-                        return []
+            client = await self._get_client()
+            response = await client.get(url, headers=headers, params=params, timeout=30)
+            if response.status_code == 200:
+                data = orjson.loads(response.content)
+                pulses = data.get('results', [])
+                logger.info(f"✅ Fetched {len(pulses)} threat pulses from OTX")
+                return pulses
+            else:
+                logger.error(f"❌ OTX API error: {response.status_code}")
+                return []
         except Exception as e:
             logger.error(f"❌ OTX fetch failed: {e}")
             return []
@@ -78,20 +257,19 @@ class ThreatFeedAggregator:
             headers['Auth-Key'] = self.urlhaus_api_key
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers, timeout=30) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        if data.get('query_status') == 'ok':
-                            urls = data.get('urls', [])[:limit]
-                            logger.info(f"✅ Fetched {len(urls)} malware URLs from URLhaus")
-                            return urls
-                        else:
-                            logger.error(f"❌ URLhaus query failed: {data.get('query_status')}")
-                            return []
+            client = await self._get_client()
+            async with client.stream('GET', url, headers=headers, timeout=30) as response:
+                if response.status_code == 200:
+                    status, urls = await self._stream_feed_items(response, 'urls', limit)
+                    if status == 'ok':
+                        logger.info(f"✅ Fetched {len(urls)} malware URLs from URLhaus")
+                        return urls
                     else:
-                        logger.error(f"❌ URLhaus API error: {response.status}")
+                        logger.error(f"❌ URLhaus query failed: {status}")
                         return []
+                else:
+                    logger.error(f"❌ URLhaus API error: {response.status_code}")
+                    return []
         except Exception as e:
             logger.error(f"❌ URLhaus fetch failed: {e}")
             return []
@@ -112,24 +290,24 @@ class ThreatFeedAggregator:
             headers['Auth-Key'] = self.urlhaus_api_key
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers, timeout=30) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        if data.get('query_status') == 'ok':
-                            payloads = data.get('payloads', [])[:limit]
-                            logger.info(f"✅ Fetched {len(payloads)} malware payloads from URLhaus")
-                            return payloads
-                        else:
-                            logger.error(f"❌ URLhaus payloads query failed: {data.get('query_status')}")
-                            return []
+            client = await self._get_client()
+            async with client.stream('GET', url, headers=headers, timeout=30) as response:
+                if response.status_code == 200:
+                    status, payloads = await self._stream_feed_items(response, 'payloads', limit)
+                    if status == 'ok':
+                        logger.info(f"✅ Fetched {len(payloads)} malware payloads from URLhaus")
+                        return payloads
                     else:
-                        logger.error(f"❌ URLhaus API error: {response.status}")
+                        logger.error(f"❌ URLhaus payloads query failed: {status}")
                         return []
+                else:
+                    logger.error(f"❌ URLhaus API error: {response.status_code}")
+                    return []
         except Exception as e:
             logger.error(f"❌ URLhaus payloads fetch failed: {e}")
             return []
     
+    @_ttl_cached_lookup
     async def check_ip_reputation(self, ip: str) -> Optional[Dict]:
         """
         Check IP reputation on AbuseIPDB
@@ -152,21 +330,59 @@ class ThreatFeedAggregator:
         params = {'ipAddress': ip, 'maxAgeInDays': 90}
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers, params=params, timeout=10) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return data.get('data', {})
-                    elif response.status == 429:
-                        logger.warning("⚠️ AbuseIPDB rate limit reached")
-                        return None
-                    else:
-                        logger.error(f"❌ AbuseIPDB API error: {response.status}")
-                        return None
+            response = await self._get_with_retry(url, headers=headers, params=params, timeout=10)
+            if response.status_code == 200:
+                data = orjson.loads(response.content)
+                return data.get('data', {})
+            elif response.status_code == 429:
+                logger.warning("⚠️ AbuseIPDB rate limit reached")
+                return None
+            else:
+                logger.error(f"❌ AbuseIPDB API error: {response.status_code}")
+                return None
         except Exception as e:
             logger.error(f"❌ AbuseIPDB check failed for {ip}: {e}")
             return None
     
+    async def check_ip_block(self, network: str) -> Optional[Dict[str, Dict]]:
+        """
+        Check every reported address in a network on AbuseIPDB in one call
+        
+        Args:
+            network: CIDR block to check (/24 or smaller on the free tier)
+            
+        Returns:
+            Reported addresses keyed by IP, or None on failure
+        """
+        if not self.abuseipdb_api_key:
+            logger.warning("AbuseIPDB API key not configured")
+            return None
+        
+        url = f"{self.abuseipdb_base}/check-block"
+        headers = {
+            'Key': self.abuseipdb_api_key,
+            'Accept': 'application/json'
+        }
+        # /check-block accepts at most 30 days of history
+        params = {'network': network, 'maxAgeInDays': 30}
+        
+        try:
+            response = await self._get_with_retry(url, headers=headers, params=params, timeout=10)
+            if response.status_code == 200:
+                data = orjson.loads(response.content)
+                reported = data.get('data', {}).get('reportedAddress', [])
+                return {entry['ipAddress']: entry for entry in reported}
+            elif response.status_code == 429:
+                logger.warning("⚠️ AbuseIPDB rate limit reached")
+                return None
+            else:
+                logger.error(f"❌ AbuseIPDB API error: {response.status_code}")
+                return None
+        except Exception as e:
+            logger.error(f"❌ AbuseIPDB block check failed for {network}: {e}")
+            return None
+    
+    @_ttl_cached_lookup
     async def check_file_hash(self, file_hash: str) -> Optional[Dict]:
         """
         Check file hash reputation on VirusTotal
@@ -185,24 +401,24 @@ class ThreatFeedAggregator:
         headers = {'x-apikey': self.virustotal_api_key}
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers, timeout=10) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return data.get('data', {})
-                    elif response.status == 404:
-                        logger.debug(f"Hash not found in VirusTotal: {file_hash[:8]}...")
-                        return None
-                    elif response.status == 429:
-                        logger.warning("⚠️ VirusTotal rate limit reached")
-                        return None
-                    else:
-                        logger.error(f"❌ VirusTotal API error: {response.status}")
-                        return None
+            response = await self._get_with_retry(url, headers=headers, timeout=10)
+            if response.status_code == 200:
+                data = orjson.loads(response.content)
+                return data.get('data', {})
+            elif response.status_code == 404:
+                logger.debug(f"Hash not found in VirusTotal: {file_hash[:8]}...")
+                return _NOT_FOUND
+            elif response.status_code == 429:
+                logger.warning("⚠️ VirusTotal rate limit reached")
+                return None
+            else:
+                logger.error(f"❌ VirusTotal API error: {response.status_code}")
+                return None
         except Exception as e:
             logger.error(f"❌ VirusTotal check failed for {file_hash[:8]}...: {e}")
             return None
     
+    @_ttl_cached_lookup
     async def check_ip_virustotal(self, ip: str) -> Optional[Dict]:
         """
         Check IP address on VirusTotal
@@ -220,20 +436,116 @@ class ThreatFeedAggregator:
         headers = {'x-apikey': self.virustotal_api_key}
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers, timeout=10) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return data.get('data', {})
-                    elif response.status == 429:
-                        logger.warning("⚠️ VirusTotal rate limit reached")
-                        return None
-                    else:
-                        return None
+            response = await self._get_with_retry(url, headers=headers, timeout=10)
+            if response.status_code == 200:
+                data = orjson.loads(response.content)
+                return data.get('data', {})
+            elif response.status_code == 429:
+                logger.warning("⚠️ VirusTotal rate limit reached")
+                return None
+            else:
+                return None
         except Exception as e:
             logger.error(f"❌ VirusTotal IP check failed for {ip}: {e}")
             return None
     
+    async def check_ips(self, ips: List[str]) -> List[Optional[Dict]]:
+        """
+        Check many IP addresses on AbuseIPDB concurrently
+        
+        Cached answers (full /check results, then earlier /check-block
+        results) are used first. Uncached IPv4 addresses that share a /24 with
+        enough other uncached IPs are resolved with a single /check-block call;
+        the rest (and any block that fails) fall back to per-IP /check lookups.
+        Block results are cached under their own key, so check_ip_reputation
+        never returns them.
+        
+        Records resolved through /check-block carry a reduced shape: only the
+        score, report count, country and last report time are known, and
+        'isp', 'domain' and 'isWhitelisted' are set to None. Addresses the
+        block does not report are scored 0 over its 30-day window.
+        
+        Args:
+            ips: IP addresses to check
+            
+        Returns:
+            Results in input order (dict, None, or the raised exception)
+        """
+        async def _one(ip: str) -> Optional[Dict]:
+            async with self._sem_abuse:
+                return await self.check_ip_reputation(ip)
+        
+        async def _block(prefix: str, members: List[str]) -> Dict[str, Optional[Dict]]:
+            async with self._sem_abuse:
+                reported = await self.check_ip_block(f"{prefix}.0/24")
+            if reported is None:
+                results = await asyncio.gather(*[_one(ip) for ip in members], return_exceptions=True)
+                return dict(zip(members, results))
+            results = {}
+            for ip in members:
+                # Addresses without reports in the block are clean
+                entry = reported.get(ip, {})
+                results[ip] = {
+                    'ipAddress': ip,
+                    'abuseConfidenceScore': entry.get('abuseConfidenceScore', 0),
+                    'totalReports': entry.get('numReports', 0),
+                    'countryCode': entry.get('countryCode'),
+                    'lastReportedAt': entry.get('mostRecentReport'),
+                    'isp': None,
+                    'domain': None,
+                    'isWhitelisted': None,
+                }
+                _lookup_cache_put(('check_ip_block', ip), results[ip])
+            return results
+        
+        # Answer from the per-IP cache before spending any quota
+        by_ip: Dict[str, Optional[Dict]] = {}
+        uncached = []
+        for ip in dict.fromkeys(ips):
+            cached = (_lookup_cache_get(('check_ip_reputation', ip))
+                      or _lookup_cache_get(('check_ip_block', ip)))
+            if cached is not None:
+                by_ip[ip] = cached
+            else:
+                uncached.append(ip)
+        
+        subnets: Dict[str, List[str]] = {}
+        for ip in uncached:
+            if ip.count('.') == 3:
+                subnets.setdefault(ip.rsplit('.', 1)[0], []).append(ip)
+        
+        blocks = {prefix: members for prefix, members in subnets.items()
+                  if len(members) >= self.CHECK_BLOCK_MIN_IPS}
+        blocked_ips = {ip for members in blocks.values() for ip in members}
+        singles = [ip for ip in uncached if ip not in blocked_ips]
+        
+        block_results, single_results = await asyncio.gather(
+            asyncio.gather(*[_block(prefix, members) for prefix, members in blocks.items()],
+                           return_exceptions=True),
+            asyncio.gather(*[_one(ip) for ip in singles], return_exceptions=True)
+        )
+        
+        by_ip.update(zip(singles, single_results))
+        for (prefix, members), result in zip(blocks.items(), block_results):
+            by_ip.update(dict.fromkeys(members, result) if isinstance(result, Exception) else result)
+        return [by_ip[ip] for ip in ips]
+    
+    async def check_hashes(self, hashes: List[str]) -> List[Optional[Dict]]:
+        """
+        Check many file hashes on VirusTotal concurrently
+        
+        Args:
+            hashes: MD5, SHA1, or SHA256 hashes to check
+            
+        Returns:
+            Results in input order (dict, None, or the raised exception)
+        """
+        async def _one(file_hash: str) -> Optional[Dict]:
+            async with self._sem_vt:
+                return await self.check_file_hash(file_hash)
+        
+        return await asyncio.gather(*[_one(h) for h in hashes], return_exceptions=True)
+    
     async def fetch_all_feeds(self) -> Dict[str, List[Dict]]:
         """
         Fetch data from all threat feeds concurrently
@@ -243,19 +555,23 @@ class ThreatFeedAggregator:
         """
         logger.info("🔄 Fetching threat intelligence from all sources...")
         
-        # Fetch all feeds concurrently
-        results = await asyncio.gather(
-            self.fetch_otx_pulses(limit=50),
-            self.fetch_urlhaus_urls(limit=100),
-            self.fetch_urlhaus_payloads(limit=100),
-            return_exceptions=True
-        )
+        # Fetch all feeds concurrently; a failing feed cancels its siblings
+        tasks: Dict[str, asyncio.Task] = {}
+        try:
+            async with asyncio.TaskGroup() as tg:
+                tasks = {
+                    'otx_pulses': tg.create_task(self.fetch_otx_pulses(limit=50)),
+                    'urlhaus_urls': tg.create_task(self.fetch_urlhaus_urls(limit=100)),
+                    'urlhaus_payloads': tg.create_task(self.fetch_urlhaus_payloads(limit=100)),
+                }
+        except* Exception as eg:
+            for exc in eg.exceptions:
+                logger.error(f"❌ Feed fetch failed: {exc}")
         
-        # Handle results
+        # Keep whatever finished; failed or cancelled feeds come back empty
         feeds = {
-            'otx_pulses': results[0] if not isinstance(results[0], Exception) else [],
-            'urlhaus_urls': results[1] if not isinstance(results[1], Exception) else [],
-            'urlhaus_payloads': results[2] if not isinstance(results[2], Exception) else [],
+            name: task.result() if task.done() and not task.cancelled() and task.exception() is None else []
+            for name, task in tasks.items()
         }
         
         total_items = sum(len(items) for items in feeds.values())